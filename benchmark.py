@@ -0,0 +1,718 @@
+"""
+benchmarks of the messaging app. the app is driven from many threads at once, either in process through the flask
+test client or over HTTP against a running server (e.g. a local gunicorn), on a database seeded with as many
+users and messages as asked, the messages are spread between the users with a zipf like skew so a few users
+have huge mailboxes and most have small ones
+
+usage:
+    python benchmark.py seed --database bench.db [--users 1000] [--messages 100000] [--skew 1.1] [--shards 1]
+    python benchmark.py load [--database bench.db] [--url http://127.0.0.1:8000] [--clients 16]
+                             [--requests 500] [--shards 1] [--output results.json]
+    python benchmark.py compare old-results.json new-results.json [--threshold 10]
+    python benchmark.py writes [--messages 5000] [--clients 16] [--users 50] [--shards 1] [--local-fraction 1]
+                               [--workers 4 | --url http://127.0.0.1:8000 --database bench.db] [--output writes.json]
+    python benchmark.py shards [--shards 1 2 4] [--messages 5000] [--clients 16] [--users 50] [--local-fraction 1]
+                               [--workers 4]
+
+when --database is not given, load seeds a new database in a temporary directory first. to benchmark a gunicorn
+server, seed a database, start the server on it (DATABASE_URL=sqlite:///<path> gunicorn main:app --threads 8)
+and run load with both --database (the same file, to know the users and messages) and --url
+
+shards runs writes once per shard count, each in a new process (the shards are configured when main is
+imported), every shard being a SQLite file of its own next to the main database. --local-fraction is the part of
+the messages sent to a user of the sender's own shard, the others go to users of the other shards and are stored
+on both, without it the receivers are picked from all the users. writes sends the messages in process unless
+--workers starts a gunicorn server with that many worker processes (once per commit mode), or --url points to a
+running one - seeded with seed --shards and started on the same database and shards as the seed (SHARD_DATABASE_URLS
+of the files <database>-shard1, <database>-shard2...)
+"""
+# ---------------------------------------IMPORTS--------------------------------------------------------------
+import argparse
+import bisect
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+# ---------------------------------------CONSTANTS--------------------------------------------------------------
+PASSWORD = 'password'
+# how many rows are inserted in one statement while seeding
+SEED_BATCH_SIZE = 10000
+# the endpoints that load drives, in the order they are benchmarked
+ENDPOINTS = ['/login', '/writeMessage', '/readMessage', '/getAllUnreadMessages', '/getAllMessages',
+             '/searchMessages', '/deleteMessage/<id>']
+# the seeded messages are made of made up words, picked with a zipf like skew so /searchMessages gets both
+# common words (long lists of matches) and rare ones
+SYLLABLES = ['ba', 'ko', 'mi', 'ru', 'te', 'lo', 'sha', 'ni', 've', 'do', 'pa', 'zu']
+VOCABULARY = [first + second + third for first in SYLLABLES for second in SYLLABLES for third in SYLLABLES]
+WORDS_PER_MESSAGE = 8
+VOCABULARY_SKEW = 1.0
+# the threads of every gunicorn worker started by writes --workers, and how long (in seconds) it may take to start
+SERVER_THREADS = 8
+SERVER_START_TIMEOUT = 30
+
+
+# ---------------------------------------CLASSES--------------------------------------------------------------
+
+class TestClientTransport:
+    """
+    a class that sends requests to the app in process through the flask test client
+    """
+
+    def __init__(self, main):
+        self.client = main.app.test_client()
+
+    def request(self, method, path, headers=None, body=None):
+        return self.client.open(path, method=method, headers=headers, json=body).status_code
+
+
+class HttpTransport:
+    """
+    a class that sends requests to a running server over HTTP
+    """
+
+    def __init__(self, baseUrl):
+        self.baseUrl = baseUrl.rstrip('/')
+
+    def request(self, method, path, headers=None, body=None):
+        headers = dict(headers or {})
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        httpRequest = urllib.request.Request(self.baseUrl + path, data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(httpRequest) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            return error.code
+
+
+class SkewedPicker:
+    """
+    a class that picks users with a zipf like skew, user number i is picked with a weight of 1 / (i + 1) ** skew
+    """
+
+    def __init__(self, numberOfUsers, skew):
+        self.cumulativeWeights = []
+        totalWeight = 0.0
+        for rank in range(numberOfUsers):
+            totalWeight += 1.0 / (rank + 1) ** skew
+            self.cumulativeWeights.append(totalWeight)
+
+    def pick(self, randomGenerator):
+        return bisect.bisect(self.cumulativeWeights, randomGenerator.random() * self.cumulativeWeights[-1])
+
+
+# ---------------------------------------FUNCTIONS------------------------------------------------------------
+
+def importApp(databasePath, numberOfShards=1):
+    """
+    a function that imports the app on the given SQLite database, the database URL is read once when main is
+    imported (and the database is migrated then)
+    :param databasePath: the path of the database file
+    :param numberOfShards: how many shards the messages are split between, the extra shards are SQLite files
+    next to the database
+    :return: the main module
+    """
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.abspath(databasePath)
+    os.environ['SHARD_DATABASE_URLS'] = ','.join('sqlite:///' + os.path.abspath(databasePath) + '-shard' + str(number)
+                                                 for number in range(1, numberOfShards))
+    import main
+    return main
+
+
+def seedDatabase(main, numberOfUsers, numberOfMessages, skew, readFraction, randomSeed):
+    """
+    a function that fills an empty database with users and messages, senders and receivers are picked with
+    the given skew, the messages are inserted directly (not through the endpoints) in big batches, on the shards
+    they belong to when there are several
+    :param main: the main module
+    :param numberOfUsers: how many users to register
+    :param numberOfMessages: how many messages to insert
+    :param skew: the zipf exponent of the mailbox sizes, 0 spreads the messages evenly
+    :param readFraction: the part of the messages that are already read
+    :param randomSeed: the seed of the random generator, the same seed gives the same database
+    :return: void
+    """
+    randomGenerator = random.Random(randomSeed)
+    picker = SkewedPicker(numberOfUsers, skew)
+    wordPicker = SkewedPicker(len(VOCABULARY), VOCABULARY_SKEW)
+    with main.engine.begin() as connection:
+        connection.execute(main.User.__table__.insert(), [
+            {'userId': userNumber + 1, 'username': 'user' + str(userNumber), 'password': PASSWORD}
+            for userNumber in range(numberOfUsers)])
+        if main.shardRouter.isSharded:
+            connection.execute(main.ShardDirectory.__table__.insert(), [
+                {'userId': userNumber + 1, 'shardNumber': (userNumber + 1) % len(main.shardRouter.engines)}
+                for userNumber in range(numberOfUsers)])
+    creationDate = datetime.now()
+    for start in range(0, numberOfMessages, SEED_BATCH_SIZE):
+        messageRows = []
+        for messageNumber in range(start, min(start + SEED_BATCH_SIZE, numberOfMessages)):
+            messageRows.append({'id': messageNumber + 1,
+                                'sender': picker.pick(randomGenerator) + 1,
+                                'receiver': picker.pick(randomGenerator) + 1,
+                                'subjectOfTheMessage': 'subject ' + str(messageNumber),
+                                'bodyOfTheMessage': 'the body of message number ' + str(messageNumber) + ' ' +
+                                                    ' '.join(VOCABULARY[wordPicker.pick(randomGenerator)]
+                                                             for _ in range(WORDS_PER_MESSAGE)),
+                                'creationDate': creationDate,
+                                'isRead': randomGenerator.random() < readFraction,
+                                'isDeltedBySender': False,
+                                'isDeltedByReceiver': False,
+                                'isCopy': False})
+        for shardNumber, shardRows in main.shardRouter.placeMessageCopies(messageRows).items():
+            with main.shardRouter.engines[shardNumber].begin() as connection:
+                connection.execute(main.Message.__table__.insert(), shardRows)
+    for shardNumber in range(len(main.shardRouter.engines)):
+        main.rebuildMailboxCounters(shardNumber)
+    if main.shardRouter.isSharded:
+        main.messageIdAllocator.initialize()
+    main.shardRouter.removeSessions()
+    for shardEngine in main.shardRouter.engines:
+        with shardEngine.begin() as connection:
+            connection.execute(main.text('ANALYZE'))
+
+
+def loadSeededDatabase(main):
+    """
+    a function that reads what load needs to know about a seeded database
+    :param main: the main module
+    :return: the users as a list of (userId, username) and the messages as a list of (id, receiver)
+    """
+    users = [(userId, username) for userId, username in
+             main.session.query(main.User.userId, main.User.username).order_by(main.User.userId)]
+    # the copies of the messages on the shards of their senders aren't in the mailboxes of the receivers
+    messages = [(messageId, receiver) for shardSession in main.shardRouter.sessions
+                for messageId, receiver in shardSession.query(main.Message.id, main.Message.receiver)
+                .filter(~(main.Message.isCopy & main.Message.isDeltedByReceiver))]
+    main.shardRouter.removeSessions()
+    return users, messages
+
+
+def createAuthorizationHeaders(main, users):
+    """
+    a function that creates an access token for every user (the same way /login does), the server accepts them
+    as long as it uses the same JWT secret
+    :param main: the main module
+    :param users: the users as a list of (userId, username)
+    :return: a dictionary of userId to the authorization headers of the user
+    """
+    with main.app.app_context():
+        return {userId: {'Authorization': 'Bearer ' + main.create_access_token(identity=userId)}
+                for userId, _ in users}
+
+
+def percentile(sortedValues, percent):
+    """
+    a function that returns the percentile of already sorted values (nearest rank)
+    :param sortedValues: the values, sorted
+    :param percent: the percentile, 0 to 100
+    :return: the value at that percentile, None if there are no values
+    """
+    if not sortedValues:
+        return None
+    return sortedValues[max(int(math.ceil(percent / 100.0 * len(sortedValues))) - 1, 0)]
+
+
+def runClients(numberOfClients, clientFunction):
+    """
+    a function that runs the same function from many threads at once and measures how long they took
+    :param numberOfClients: how many threads to run
+    :param clientFunction: the function every thread runs, it gets the number of the client
+    :return: the time (in seconds) until all of them finished
+    """
+    threads = [threading.Thread(target=clientFunction, args=(clientNumber,)) for clientNumber in
+               range(numberOfClients)]
+    startedAt = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - startedAt
+
+
+def countQueries(main):
+    """
+    a function that starts counting the SQL statements the app runs (only possible in process)
+    :param main: the main module
+    :return: a function that returns how many statements ran since
+    """
+    lock = threading.Lock()
+    executedStatements = [0]
+
+    def countStatement(*arguments):
+        with lock:
+            executedStatements[0] += 1
+
+    # every shard (and the archive databases) has an engine of its own
+    for databaseEngine in set(main.shardRouter.engines + main.shardRouter.archiveEngines):
+        main.event.listen(databaseEngine, 'before_cursor_execute', countStatement)
+    return lambda: executedStatements[0]
+
+
+def benchmarkEndpoint(createTransport, buildRequest, numberOfRequests, numberOfClients, queryCounter):
+    """
+    a function that sends requests to one endpoint from many clients at once and measures them
+    :param createTransport: a function that creates a transport for a client (see TestClientTransport)
+    :param buildRequest: a function that gets the number of the request and returns its (method, path,
+    headers, body)
+    :param numberOfRequests: how many requests to send (all the clients together)
+    :param numberOfClients: how many clients send at once
+    :param queryCounter: a function that returns how many SQL statements ran so far, None if unknown
+    :return: a dictionary with the results of the endpoint
+    """
+    latencies = [[] for _ in range(numberOfClients)]
+    errors = [0] * numberOfClients
+
+    def sendRequests(clientNumber):
+        transport = createTransport()
+        for requestNumber in range(clientNumber, numberOfRequests, numberOfClients):
+            method, path, headers, body = buildRequest(requestNumber)
+            startedAt = time.perf_counter()
+            statusCode = transport.request(method, path, headers, body)
+            latencies[clientNumber].append(time.perf_counter() - startedAt)
+            if statusCode >= 400:
+                errors[clientNumber] += 1
+
+    queriesBefore = queryCounter() if queryCounter else None
+    elapsedSeconds = runClients(numberOfClients, sendRequests)
+    allLatencies = sorted(latency * 1000 for clientLatencies in latencies for latency in clientLatencies)
+    return {'requests': numberOfRequests,
+            'errors': sum(errors),
+            'throughput': numberOfRequests / elapsedSeconds,
+            'p50_ms': percentile(allLatencies, 50),
+            'p95_ms': percentile(allLatencies, 95),
+            'p99_ms': percentile(allLatencies, 99),
+            'queries_per_request': (queryCounter() - queriesBefore) / numberOfRequests if queryCounter else None}
+
+
+def buildEndpointRequests(users, messages, headersByUser, picker, pageSize, randomSeed):
+    """
+    a function that builds the request generator of every endpoint, the users of the requests are picked with
+    the same skew as the database, so the users with the biggest mailboxes get most of the requests
+    :param users: the users as a list of (userId, username)
+    :param messages: the messages as a list of (id, receiver)
+    :param headersByUser: the authorization headers of every user
+    :param picker: the SkewedPicker of the users
+    :param pageSize: the limit argument of the mailbox requests, 0 for whole mailboxes
+    :param randomSeed: the seed of the random generators
+    :return: a dictionary of endpoint to a function that builds its requests, see benchmarkEndpoint
+    """
+    mailboxQuery = '?limit=' + str(pageSize) if pageSize else ''
+    messagesToDelete = list(messages)
+    wordPicker = SkewedPicker(len(VOCABULARY), VOCABULARY_SKEW)
+    random.Random(randomSeed).shuffle(messagesToDelete)
+
+    def pickUser(requestNumber, salt=0):
+        return users[picker.pick(random.Random(randomSeed * 1000003 + requestNumber * 31 + salt))]
+
+    def login(requestNumber):
+        _, username = pickUser(requestNumber)
+        return 'POST', '/login', None, {'username': username, 'password': PASSWORD}
+
+    def writeMessage(requestNumber):
+        senderId, _ = pickUser(requestNumber)
+        _, receiverName = pickUser(requestNumber, salt=1)
+        return 'POST', '/writeMessage', headersByUser[senderId], \
+            {'receiver': receiverName, 'subject': 'benchmark', 'body': 'request number ' + str(requestNumber)}
+
+    def mailboxRequest(path):
+        def buildRequest(requestNumber):
+            userId, _ = pickUser(requestNumber)
+            return 'GET', path, headersByUser[userId], None
+        return buildRequest
+
+    def deleteMessage(requestNumber):
+        messageId, receiver = messagesToDelete[requestNumber % len(messagesToDelete)]
+        return 'DELETE', '/deleteMessage/' + str(messageId), headersByUser[receiver], None
+
+    def searchMessages(requestNumber):
+        userId, _ = pickUser(requestNumber)
+        word = VOCABULARY[wordPicker.pick(random.Random(randomSeed * 1000003 + requestNumber * 31 + 2))]
+        return 'GET', '/searchMessages?q=' + word, headersByUser[userId], None
+
+    return {'/login': login,
+            '/writeMessage': writeMessage,
+            '/readMessage': mailboxRequest('/readMessage'),
+            '/getAllUnreadMessages': mailboxRequest('/getAllUnreadMessages' + mailboxQuery),
+            '/getAllMessages': mailboxRequest('/getAllMessages' + mailboxQuery),
+            '/searchMessages': searchMessages,
+            '/deleteMessage/<id>': deleteMessage}
+
+
+def currentCommit():
+    """
+    a function that returns the git commit the benchmark runs on
+    :return: the commit hash, None if it isn't known
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def seedCommand(arguments):
+    """
+    a function that seeds a new database file for the benchmarks
+    :param arguments: the parsed command line arguments
+    :return: void
+    """
+    if os.path.exists(arguments.database):
+        sys.exit(arguments.database + ' already exists, seed a new file')
+    main = importApp(arguments.database, arguments.shards)
+    startedAt = time.perf_counter()
+    seedDatabase(main, arguments.users, arguments.messages, arguments.skew, arguments.read_fraction,
+                 arguments.seed)
+    print('seeded %d users and %d messages in %.1f seconds' % (arguments.users, arguments.messages,
+                                                               time.perf_counter() - startedAt))
+
+
+def loadCommand(arguments):
+    """
+    a function that benchmarks every endpoint one after the other, prints the results and saves them as json
+    :param arguments: the parsed command line arguments
+    :return: void
+    """
+    databasePath = arguments.database
+    if databasePath is None:
+        databasePath = os.path.join(tempfile.mkdtemp(), 'benchmarkDB.db')
+        main = importApp(databasePath, arguments.shards)
+        seedDatabase(main, arguments.users, arguments.messages, arguments.skew, arguments.read_fraction,
+                     arguments.seed)
+    else:
+        main = importApp(databasePath, arguments.shards)
+    users, messages = loadSeededDatabase(main)
+    headersByUser = createAuthorizationHeaders(main, users)
+    picker = SkewedPicker(len(users), arguments.skew)
+    requestBuilders = buildEndpointRequests(users, messages, headersByUser, picker, arguments.page_size,
+                                            arguments.seed)
+
+    if arguments.url:
+        def createTransport():
+            return HttpTransport(arguments.url)
+        queryCounter = None
+    else:
+        def createTransport():
+            return TestClientTransport(main)
+        queryCounter = countQueries(main)
+
+    results = {'commit': currentCommit(),
+               'created_at': datetime.now().isoformat(),
+               'config': {'users': len(users), 'messages': len(messages), 'skew': arguments.skew,
+                          'clients': arguments.clients, 'requests': arguments.requests,
+                          'page_size': arguments.page_size, 'shards': arguments.shards,
+                          'transport': 'http' if arguments.url else 'test client'},
+               'endpoints': {}}
+    for endpoint in ENDPOINTS:
+        if arguments.endpoints and endpoint not in arguments.endpoints:
+            continue
+        endpointResults = benchmarkEndpoint(createTransport, requestBuilders[endpoint], arguments.requests,
+                                            arguments.clients, queryCounter)
+        results['endpoints'][endpoint] = endpointResults
+        print('%-22s %8.1f req/s  p50 %8.2f ms  p95 %8.2f ms  p99 %8.2f ms  errors %d  queries/request %s' % (
+            endpoint, endpointResults['throughput'], endpointResults['p50_ms'], endpointResults['p95_ms'],
+            endpointResults['p99_ms'], endpointResults['errors'],
+            '-' if endpointResults['queries_per_request'] is None else
+            '%.1f' % endpointResults['queries_per_request']))
+
+    if arguments.output:
+        with open(arguments.output, 'w') as outputFile:
+            json.dump(results, outputFile, indent=2)
+        print('results saved to ' + arguments.output)
+
+
+def compareCommand(arguments):
+    """
+    a function that compares two saved results and fails if an endpoint got slower (p50, p95 or throughput) by
+    more than the threshold, or runs more queries per request
+    :param arguments: the parsed command line arguments
+    :return: void
+    """
+    with open(arguments.old) as oldFile:
+        oldResults = json.load(oldFile)
+    with open(arguments.new) as newFile:
+        newResults = json.load(newFile)
+    print('comparing %s to %s' % (oldResults.get('commit'), newResults.get('commit')))
+    regressions = 0
+    for endpoint, newEndpoint in newResults['endpoints'].items():
+        oldEndpoint = oldResults['endpoints'].get(endpoint)
+        if oldEndpoint is None:
+            continue
+        changes = []
+        for metric, higherIsBetter in (('throughput', True), ('p50_ms', False), ('p95_ms', False)):
+            changePercent = (newEndpoint[metric] - oldEndpoint[metric]) / oldEndpoint[metric] * 100
+            regressed = changePercent < -arguments.threshold if higherIsBetter else \
+                changePercent > arguments.threshold
+            regressions += regressed
+            changes.append('%s %+.1f%%%s' % (metric, changePercent, ' REGRESSION' if regressed else ''))
+        if oldEndpoint.get('queries_per_request') is not None and newEndpoint.get('queries_per_request') is not None \
+                and newEndpoint['queries_per_request'] > oldEndpoint['queries_per_request']:
+            regressions += 1
+            changes.append('queries/request %.1f -> %.1f REGRESSION' % (oldEndpoint['queries_per_request'],
+                                                                        newEndpoint['queries_per_request']))
+        print('%-22s %s' % (endpoint, ', '.join(changes)))
+    if regressions:
+        sys.exit(1)
+
+
+def pickReceivers(main, users, numberOfMessages, localFraction, randomSeed):
+    """
+    a function that picks the receiver of every message the writes benchmark sends, the sender of message number
+    i is user number i (round robin)
+    :param main: the main module
+    :param users: the users as a list of (userId, username)
+    :param numberOfMessages: how many messages are sent
+    :param localFraction: the part of the messages sent to a user of the sender's shard, None picks the receivers
+    from all the users (so with N shards about (N - 1) / N of the messages are stored on two shards)
+    :param randomSeed: the seed of the random generator
+    :return: the usernames of the receivers by message number, and the part of the messages that cross shards
+    """
+    shardsByUser = main.shardRouter.shardsOf([userId for userId, _ in users])
+    main.shardRouter.removeSessions()
+    usersByShard = {}
+    for userId, username in users:
+        usersByShard.setdefault(shardsByUser[userId], []).append(username)
+    # the users of the other shards, a single shard has none so every message is local there
+    otherUsersByShard = {shardNumber: [username for otherShard, shardUsers in usersByShard.items()
+                                       if otherShard != shardNumber for username in shardUsers] or shardUsers
+                         for shardNumber, shardUsers in usersByShard.items()}
+    usernames = [username for _, username in users]
+    randomGenerator = random.Random(randomSeed)
+    receivers = []
+    crossShardMessages = 0
+    for messageNumber in range(numberOfMessages):
+        senderId, _ = users[messageNumber % len(users)]
+        senderShard = shardsByUser[senderId]
+        if localFraction is None:
+            receivers.append(randomGenerator.choice(usernames))
+        elif randomGenerator.random() < localFraction:
+            receivers.append(randomGenerator.choice(usersByShard[senderShard]))
+        else:
+            receivers.append(randomGenerator.choice(otherUsersByShard[senderShard]))
+        crossShardMessages += receivers[-1] not in usersByShard[senderShard]
+    return receivers, crossShardMessages / numberOfMessages if numberOfMessages else 0
+
+
+def benchmarkWrites(createTransport, users, headersByUser, receivers, numberOfClients):
+    """
+    a function that sends messages through /writeMessage from many clients at once
+    :param createTransport: a function that creates a transport for a client (see TestClientTransport)
+    :param users: the users as a list of (userId, username)
+    :param headersByUser: the authorization headers of every user
+    :param receivers: the usernames of the receivers by message number, see pickReceivers
+    :param numberOfClients: how many clients send at once
+    :return: messages per second, and how many requests failed
+    """
+    def buildRequest(messageNumber):
+        senderId, _ = users[messageNumber % len(users)]
+        return 'POST', '/writeMessage', headersByUser[senderId], \
+            {'receiver': receivers[messageNumber], 'subject': 'benchmark', 'body': 'message number ' +
+             str(messageNumber)}
+
+    results = benchmarkEndpoint(createTransport, buildRequest, len(receivers), numberOfClients, None)
+    return results['throughput'], results['errors']
+
+
+def startServer(numberOfWorkers, writeBehind):
+    """
+    a function that starts a gunicorn server with many worker processes on the database (and the shards) main was
+    imported with, so the messages are sent from several processes at once, with the change log notifier that
+    several workers need (MAILBOX_NOTIFIER)
+    :param numberOfWorkers: how many worker processes gunicorn runs
+    :param writeBehind: True to commit the messages with the group commit writers (WRITE_BEHIND)
+    :return: the gunicorn process and the base URL of the server, once it answers
+    """
+    with socket.socket() as freePort:
+        freePort.bind(('127.0.0.1', 0))
+        port = freePort.getsockname()[1]
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'main:app', '--workers', str(numberOfWorkers),
+                               '--threads', str(SERVER_THREADS), '--bind', '127.0.0.1:' + str(port),
+                               '--log-level', 'warning'],
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              env=dict(os.environ, WRITE_BEHIND='1' if writeBehind else '',
+                                       MAILBOX_NOTIFIER='changelog'))
+    baseUrl = 'http://127.0.0.1:' + str(port)
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while True:
+        try:
+            HttpTransport(baseUrl).request('GET', '/unreadCount')
+            return server, baseUrl
+        except urllib.error.URLError:
+            if server.poll() is not None or time.monotonic() >= deadline:
+                server.kill()
+                sys.exit('gunicorn did not start')
+            time.sleep(0.1)
+
+
+def writesCommand(arguments):
+    """
+    a function that compares the throughput of /writeMessage when every request commits on its own with the
+    write behind mode, where a group commit writer per shard (in every worker process) commits many requests
+    together. against a running server (--url) it measures only the mode the server runs in
+    :param arguments: the parsed command line arguments
+    :return: void
+    """
+    if arguments.url:
+        if arguments.database is None:
+            sys.exit('give the database the server runs on with --database')
+        main = importApp(arguments.database, arguments.shards)
+    else:
+        main = importApp(os.path.join(tempfile.mkdtemp(), 'benchmarkDB.db'), arguments.shards)
+        seedDatabase(main, arguments.users, 0, 0, 0, 0)
+    users, _ = loadSeededDatabase(main)
+    headersByUser = createAuthorizationHeaders(main, users)
+    receivers, crossShardFraction = pickReceivers(main, users, arguments.messages, arguments.local_fraction, 0)
+    results = {'shards': arguments.shards, 'workers': arguments.workers, 'cross_shard_fraction': crossShardFraction}
+    print('%d shards, %.0f%% of the messages cross shards, %s' % (
+        arguments.shards, crossShardFraction * 100, 'server at ' + arguments.url if arguments.url else
+        '%d gunicorn workers' % arguments.workers if arguments.workers else 'in process'))
+
+    def measureWrites(resultName, label, createTransport):
+        messagesPerSecond, failures = benchmarkWrites(createTransport, users, headersByUser, receivers,
+                                                      arguments.clients)
+        results[resultName] = messagesPerSecond
+        print('%-20s%.0f messages/sec (%d failed)' % (label + ':', messagesPerSecond, failures))
+
+    if arguments.url:
+        measureWrites('server', 'server', lambda: HttpTransport(arguments.url))
+    elif arguments.workers:
+        for resultName, label, writeBehind in (('commit_per_request', 'commit per request', False),
+                                               ('group_commit', 'group commit', True)):
+            server, baseUrl = startServer(arguments.workers, writeBehind)
+            try:
+                measureWrites(resultName, label, lambda: HttpTransport(baseUrl))
+            finally:
+                server.terminate()
+                server.wait()
+    else:
+        main.groupCommitWriters = None
+        measureWrites('commit_per_request', 'commit per request', lambda: TestClientTransport(main))
+        main.groupCommitWriters = [main.GroupCommitWriter(shardNumber, main.WRITE_BEHIND_BATCH_SIZE,
+                                                          main.WRITE_BEHIND_MAX_DELAY, main.WRITE_BEHIND_QUEUE_SIZE)
+                                   for shardNumber in range(len(main.shardRouter.engines))]
+        measureWrites('group_commit', 'group commit', lambda: TestClientTransport(main))
+        for groupCommitWriter in main.groupCommitWriters:
+            print('group commit stats of shard %d: %s' % (groupCommitWriter.shardNumber, groupCommitWriter.stats()))
+
+    if arguments.output:
+        with open(arguments.output, 'w') as outputFile:
+            json.dump(results, outputFile, indent=2)
+
+
+def shardsCommand(arguments):
+    """
+    a function that runs the writes benchmark for every shard count, each in a process of its own, and prints
+    how the throughput of /writeMessage scales with the number of shards
+    :param arguments: the parsed command line arguments
+    :return: void
+    """
+    outputPath = os.path.join(tempfile.mkdtemp(), 'writes.json')
+    resultsByShards = {}
+    for numberOfShards in arguments.shards:
+        print('--- %d shards' % numberOfShards)
+        sys.stdout.flush()
+        writesArguments = ['writes', '--shards', str(numberOfShards), '--messages', str(arguments.messages),
+                           '--clients', str(arguments.clients), '--users', str(arguments.users),
+                           '--workers', str(arguments.workers), '--output', outputPath]
+        if arguments.local_fraction is not None:
+            writesArguments += ['--local-fraction', str(arguments.local_fraction)]
+        subprocess.check_call([sys.executable, os.path.abspath(__file__)] + writesArguments)
+        with open(outputPath) as outputFile:
+            resultsByShards[numberOfShards] = json.load(outputFile)
+
+    baseline = resultsByShards[arguments.shards[0]]
+    print('%-8s %12s %28s %28s' % ('shards', 'cross shard', 'commit per request (msg/s)', 'group commit (msg/s)'))
+    for numberOfShards, results in resultsByShards.items():
+        print('%-8d %11.0f%% %19.0f (x%.2f) %19.0f (x%.2f)' % (
+            numberOfShards, results['cross_shard_fraction'] * 100, results['commit_per_request'],
+            results['commit_per_request'] / baseline['commit_per_request'],
+            results['group_commit'], results['group_commit'] / baseline['group_commit']))
+
+
+def addSeedArguments(parser):
+    parser.add_argument('--users', type=int, default=1000, help='how many users to register')
+    parser.add_argument('--messages', type=int, default=100000, help='how many messages to insert')
+    parser.add_argument('--skew', type=float, default=1.1,
+                        help='zipf exponent of the mailbox sizes (and of the users picked by load), 0 is even')
+    parser.add_argument('--read-fraction', type=float, default=0.5, help='the part of the messages already read')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the random generators')
+    parser.add_argument('--shards', type=int, default=1, help='how many shards the messages are split between')
+
+
+def addWritesArguments(parser):
+    parser.add_argument('--local-fraction', type=float, default=None,
+                        help='the part of the messages sent to a user of the same shard as the sender, from 0 to 1, '
+                             'the receivers are picked from all the users when not given')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='send the messages to a gunicorn server with this many worker processes, 0 sends them '
+                             'in process')
+
+
+def parseArguments(argv):
+    parser = argparse.ArgumentParser(description='benchmarks of the messaging app')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    seedParser = commands.add_parser('seed', help='seed a new database file')
+    seedParser.add_argument('--database', required=True, help='path of the new SQLite database')
+    addSeedArguments(seedParser)
+    seedParser.set_defaults(function=seedCommand)
+
+    loadParser = commands.add_parser('load', help='benchmark every endpoint')
+    loadParser.add_argument('--database', help='a seeded database, a new one is seeded when not given')
+    addSeedArguments(loadParser)
+    loadParser.add_argument('--url', help='base URL of a running server, the test client is used when not given')
+    loadParser.add_argument('--clients', type=int, default=16, help='how many clients send at once')
+    loadParser.add_argument('--requests', type=int, default=500, help='how many requests to send to each endpoint')
+    loadParser.add_argument('--page-size', type=int, default=0,
+                            help='limit argument of the mailbox requests, 0 for whole mailboxes')
+    loadParser.add_argument('--endpoints', nargs='*', choices=ENDPOINTS, help='only benchmark these endpoints')
+    loadParser.add_argument('--output', help='save the results to this json file')
+    loadParser.set_defaults(function=loadCommand)
+
+    compareParser = commands.add_parser('compare', help='compare two saved results')
+    compareParser.add_argument('old', help='the results to compare to')
+    compareParser.add_argument('new', help='the new results')
+    compareParser.add_argument('--threshold', type=float, default=10,
+                               help='the change (in percent) that counts as a regression')
+    compareParser.set_defaults(function=compareCommand)
+
+    writesParser = commands.add_parser('writes', help='per request commit against group commit on /writeMessage')
+    writesParser.add_argument('--messages', type=int, default=5000, help='how many messages to send')
+    writesParser.add_argument('--clients', type=int, default=16, help='how many clients send at once')
+    writesParser.add_argument('--users', type=int, default=50, help='how many users send and receive')
+    writesParser.add_argument('--shards', type=int, default=1, help='how many shards the messages are split between')
+    addWritesArguments(writesParser)
+    writesParser.add_argument('--url', help='base URL of a running server, sends the messages in process when not '
+                                            'given')
+    writesParser.add_argument('--database', help='the seeded database the server at --url runs on')
+    writesParser.add_argument('--output', help='save the results to this json file')
+    writesParser.set_defaults(function=writesCommand)
+
+    shardsParser = commands.add_parser('shards', help='how /writeMessage scales with the number of shards')
+    shardsParser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4], help='the shard counts to run')
+    shardsParser.add_argument('--messages', type=int, default=5000, help='how many messages to send')
+    shardsParser.add_argument('--clients', type=int, default=16, help='how many clients send at once')
+    shardsParser.add_argument('--users', type=int, default=50, help='how many users send and receive')
+    addWritesArguments(shardsParser)
+    shardsParser.set_defaults(function=shardsCommand)
+
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    parsedArguments = parseArguments(sys.argv[1:])
+    parsedArguments.function(parsedArguments)
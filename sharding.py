@@ -0,0 +1,406 @@
+# ---------------------------------------IMPORTS--------------------------------------------------------------
+import threading
+import time
+
+from sqlalchemy import and_, case, func, or_, select, text, update
+
+# ---------------------------------------CONSTANTS--------------------------------------------------------------
+# how many message ids a worker reserves at once when there are several shards, see MessageIdAllocator
+MESSAGE_ID_BLOCK_SIZE = 1000
+# how many messages move-user copies to the new shard in one transaction
+MOVE_USER_BATCH_SIZE = 500
+# how many times move-user copies the mailbox while the user keeps using it before it fences the old shard
+MOVE_USER_COPY_PASSES = 5
+
+# ---------------------------------------CONFIGURATION----------------------------------------------------------
+# how often (in seconds) a worker checks if a user was moved to another shard
+SHARD_DIRECTORY_CHECK_INTERVAL = 1
+# how long (in seconds) a request waits for the move of a user to another shard to finish
+SHARD_MOVE_TIMEOUT = 10
+
+
+# ---------------------------------------CLASSES--------------------------------------------------------------
+
+class UserMovedError(Exception):
+    """
+    a class of the error raised when a mailbox is changed on a shard its user was moved away from (see
+    MailboxCounter.movedToShard), the transaction must be rolled back and the change made again on the new shard
+    """
+
+    def __init__(self, targetShardsByUser):
+        super().__init__('moved users: ' + str(targetShardsByUser))
+        # userId -> the shard the user is moved to
+        self.targetShardsByUser = targetShardsByUser
+
+
+class ShardRouter:
+    """
+    a class that routes every user to the shard (a database with its own engine and sessions) that holds his
+    mailbox - the messages he received, the ones he sent and his counters. the first shard is the main database,
+    it also keeps the users and the shard directory (ShardDirectory), a user without a directory row is on it.
+    the shards of the users are cached, and the whole cache is dropped once a user was moved, which is checked
+    against the largest version in the directory at most every SHARD_DIRECTORY_CHECK_INTERVAL seconds. with a
+    single shard nothing is looked up
+    """
+
+    def __init__(self, engines, sessions, archiveEngines, archiveSessions, directoryModel, shardsByUser,
+                 maxIdsPerStatement):
+        self.engines = engines
+        self.sessions = sessions
+        # every shard keeps its archive, the first one may have a separate archive database
+        self.archiveEngines = archiveEngines
+        self.archiveSessions = archiveSessions
+        self.directoryModel = directoryModel
+        self.isSharded = len(self.engines) > 1
+        # userId -> shard number, a bounded cache (get, put and clear)
+        self.shardsByUser = shardsByUser
+        # the longest IN (...) list a directory lookup binds
+        self.maxIdsPerStatement = maxIdsPerStatement
+        self.directoryVersion = None
+        self.directoryVersionCheckedAt = 0
+
+    def shardOf(self, userId):
+        if not self.isSharded:
+            return 0
+        self.checkDirectoryVersion()
+        shardNumber = self.shardsByUser.get(userId)
+        if shardNumber is None:
+            shardNumber = self.sessions[0].query(self.directoryModel.shardNumber) \
+                .filter(self.directoryModel.userId == userId).scalar() or 0
+            self.shardsByUser.put(userId, shardNumber)
+        return shardNumber
+
+    def shardsOf(self, userIds):
+        # a dictionary of userId to shard number, the ones that aren't cached are looked up with one IN query
+        if not self.isSharded:
+            return dict.fromkeys(userIds, 0)
+        self.checkDirectoryVersion()
+        shardsByUser = {}
+        usersToLookUp = []
+        for userId in set(userIds):
+            shardNumber = self.shardsByUser.get(userId)
+            if shardNumber is None:
+                usersToLookUp.append(userId)
+            else:
+                shardsByUser[userId] = shardNumber
+        for start in range(0, len(usersToLookUp), self.maxIdsPerStatement):
+            chunk = usersToLookUp[start:start + self.maxIdsPerStatement]
+            foundShards = dict(self.sessions[0].query(self.directoryModel.userId, self.directoryModel.shardNumber)
+                               .filter(self.directoryModel.userId.in_(chunk)))
+            for userId in chunk:
+                shardsByUser[userId] = foundShards.get(userId, 0)
+                self.shardsByUser.put(userId, shardsByUser[userId])
+        return shardsByUser
+
+    def sessionOf(self, userId):
+        return self.sessions[self.shardOf(userId)]
+
+    def archiveSessionOf(self, userId):
+        return self.archiveSessions[self.shardOf(userId)]
+
+    def checkDirectoryVersion(self):
+        if time.monotonic() - self.directoryVersionCheckedAt >= SHARD_DIRECTORY_CHECK_INTERVAL:
+            directoryVersion = self.sessions[0].query(func.max(self.directoryModel.version)).scalar()
+            self.directoryVersionCheckedAt = time.monotonic()
+            if directoryVersion != self.directoryVersion:
+                self.directoryVersion = directoryVersion
+                self.shardsByUser.clear()
+
+    def placeNewUser(self, userId):
+        # the new users are spread evenly, the directory row is added to the (uncommitted) session of the user
+        if not self.isSharded:
+            return 0
+        shardNumber = userId % len(self.engines)
+        self.sessions[0].add(self.directoryModel(userId=userId, shardNumber=shardNumber))
+        self.shardsByUser.put(userId, shardNumber)
+        return shardNumber
+
+    def placeMessageCopies(self, messageRows):
+        """
+        a function that decides where every message is stored when there are several shards, a message between
+        two users of the same shard is a single row on it, else it's stored twice under the same id - on the shard
+        of the receiver (the sender's side flagged as deleted) and on the shard of the sender (the receiver's side
+        flagged as deleted), so each side reads and changes its mailbox on its own shard
+        :param messageRows: the messages, with their ids and the flags of the sides they hold
+        :return: a dictionary of shard number to the rows to store on it
+        """
+        shardsByUser = self.shardsOf([userId for messageRow in messageRows
+                                      for userId in (messageRow['sender'], messageRow['receiver'])])
+        rowsByShard = {}
+        for messageRow in messageRows:
+            senderShard = shardsByUser[messageRow['sender']]
+            receiverShard = shardsByUser[messageRow['receiver']]
+            if messageRow['isDeltedBySender'] or messageRow['isDeltedByReceiver'] or senderShard == receiverShard:
+                ownerShard = senderShard if messageRow['isDeltedByReceiver'] else receiverShard
+                rowsByShard.setdefault(ownerShard, []).append(messageRow)
+            else:
+                rowsByShard.setdefault(receiverShard, []).append(dict(messageRow, isDeltedBySender=True,
+                                                                      isCopy=True))
+                rowsByShard.setdefault(senderShard, []).append(dict(messageRow, isDeltedByReceiver=True,
+                                                                    isCopy=True))
+        return rowsByShard
+
+    def lookUpShardNow(self, userId):
+        # reads the directory outside of the session, so a running transaction doesn't hide a move
+        with self.engines[0].connect() as connection:
+            return connection.execute(text('SELECT "shardNumber" FROM "ShardDirectory" WHERE "userId" = :userId'),
+                                      {'userId': userId}).scalar() or 0
+
+    def waitForMoves(self, targetShardsByUser):
+        # raises UserMovedError if one of the moves didn't finish within SHARD_MOVE_TIMEOUT seconds
+        deadline = time.monotonic() + SHARD_MOVE_TIMEOUT
+        for userId, targetShard in targetShardsByUser.items():
+            while self.lookUpShardNow(userId) != targetShard:
+                if time.monotonic() >= deadline:
+                    raise UserMovedError(targetShardsByUser)
+                time.sleep(SHARD_DIRECTORY_CHECK_INTERVAL / 10)
+            self.shardsByUser.put(userId, targetShard)
+
+    def rollbackSessions(self):
+        for shardSession in self.sessions:
+            shardSession.rollback()
+
+    def closeSessions(self):
+        for shardSession in set(self.sessions + self.archiveSessions):
+            shardSession.close()
+
+    def removeSessions(self):
+        for shardSession in set(self.sessions + self.archiveSessions):
+            shardSession.remove()
+
+
+class MessageIdAllocator:
+    """
+    a class that hands out the ids of new messages when there are several shards, the two copies of a message
+    (one on the shard of the receiver, one on the shard of the sender) share its id, so the ids can't come from
+    the autoincrement of a single shard. every worker reserves a block of MESSAGE_ID_BLOCK_SIZE ids at a time
+    in the MessageIdBlocks table, so the ids are unique everywhere and increase within a worker
+    """
+
+    def __init__(self, blockSize, shardRouter, blocksModel, messageModel, archivedMessageModel):
+        self.blockSize = blockSize
+        self.shardRouter = shardRouter
+        self.blocksTable = blocksModel.__table__
+        self.messageModel = messageModel
+        self.archivedMessageModel = archivedMessageModel
+        self.lock = threading.Lock()
+        self.nextId = 0
+        self.blockEnd = 0
+
+    def initialize(self):
+        # the next id must be greater than the id of every message on every shard (and in every archive)
+        largestId = 0
+        for shardSession in self.shardRouter.sessions:
+            largestId = max(largestId, shardSession.query(func.max(self.messageModel.id)).scalar() or 0)
+        for shardArchiveSession in set(self.shardRouter.archiveSessions):
+            largestId = max(largestId,
+                            shardArchiveSession.query(func.max(self.archivedMessageModel.id)).scalar() or 0)
+        with self.shardRouter.engines[0].begin() as connection:
+            if not connection.execute(update(self.blocksTable).values(nextId=case(
+                    (self.blocksTable.c.nextId <= largestId, largestId + 1),
+                    else_=self.blocksTable.c.nextId))).rowcount:
+                connection.execute(self.blocksTable.insert().values(id=1, nextId=largestId + 1))
+        self.shardRouter.removeSessions()
+
+    def allocate(self, numberOfIds):
+        with self.lock:
+            messageIds = []
+            while len(messageIds) < numberOfIds:
+                if self.nextId >= self.blockEnd:
+                    self.reserveBlock(max(self.blockSize, numberOfIds - len(messageIds)))
+                takenIds = min(numberOfIds - len(messageIds), self.blockEnd - self.nextId)
+                messageIds.extend(range(self.nextId, self.nextId + takenIds))
+                self.nextId += takenIds
+            return messageIds
+
+    def reserveBlock(self, blockSize):
+        with self.shardRouter.engines[0].begin() as connection:
+            connection.execute(update(self.blocksTable).values(nextId=self.blocksTable.c.nextId + blockSize))
+            self.blockEnd = connection.execute(select(self.blocksTable.c.nextId)).scalar()
+        self.nextId = self.blockEnd - blockSize
+
+
+class MailboxMover:
+    """
+    a class that moves the mailboxes of users between shards while the service keeps running (the move-user and
+    rebalance-shards commands), the messages and the archived messages of a user are copied to the new shard and
+    then removed from the old one
+    """
+
+    def __init__(self, shardRouter, messageModel, archivedMessageModel, counterModel, countMailbox):
+        self.shardRouter = shardRouter
+        self.messageModel = messageModel
+        self.archivedMessageModel = archivedMessageModel
+        self.counterModel = counterModel
+        # a function of (shardSession, userId) that counts the mailbox of a user into a new counterModel
+        self.countMailbox = countMailbox
+
+    def copyMailboxSide(self, messagesModel, userId, sourceSession, targetSession):
+        """
+        a function that makes the side of a user in a table of messages on the target shard the same as it is on
+        the source shard, MOVE_USER_BATCH_SIZE messages at a time (a transaction each). a message he sees on the
+        source is copied to the target with the other side flagged as deleted (that side stays on its own shard),
+        or his side is turned on in the row that is already there, and his side of the messages he doesn't see on
+        the source anymore is turned off on the target
+        :param messagesModel: the messages or the archived messages
+        :param userId: the user that is moved
+        :param sourceSession: the session of the shard the user is moved from
+        :param targetSession: the session of the shard the user is moved to
+        :return: how many messages changed on the target
+        """
+        sideCondition = mailboxSideCondition(messagesModel, userId)
+        messageIds = sorted({messageId for messageId, in sourceSession.query(messagesModel.id).filter(sideCondition)} |
+                            {messageId for messageId, in targetSession.query(messagesModel.id).filter(sideCondition)})
+        changedMessages = 0
+        for start in range(0, len(messageIds), MOVE_USER_BATCH_SIZE):
+            chunk = messageIds[start:start + MOVE_USER_BATCH_SIZE]
+            sourceMessages = {message.id: message for message in
+                              sourceSession.query(messagesModel).filter(messagesModel.id.in_(chunk))}
+            targetMessages = {message.id: message for message in
+                              targetSession.query(messagesModel).filter(messagesModel.id.in_(chunk))}
+            newRows = []
+            for messageId in chunk:
+                sourceMessage = sourceMessages.get(messageId)
+                targetMessage = targetMessages.get(messageId)
+                # the flags of the side of the user, a message that is gone from the source is deleted for him
+                sideFlags = {}
+                knownMessage = sourceMessage if sourceMessage is not None else targetMessage
+                if knownMessage.receiver == userId:
+                    sideFlags['isDeltedByReceiver'] = sourceMessage is None or sourceMessage.isDeltedByReceiver
+                    if sourceMessage is not None:
+                        sideFlags['isRead'] = sourceMessage.isRead
+                if knownMessage.sender == userId:
+                    sideFlags['isDeltedBySender'] = sourceMessage is None or sourceMessage.isDeltedBySender
+                if targetMessage is None:
+                    if sideFlags.get('isDeltedByReceiver', True) and sideFlags.get('isDeltedBySender', True):
+                        continue
+                    newRow = {column.key: getattr(sourceMessage, column.key)
+                              for column in messagesModel.__table__.columns}
+                    newRow.update({'isDeltedBySender': True, 'isDeltedByReceiver': True}, **sideFlags)
+                    if messagesModel is self.messageModel:
+                        newRow['isCopy'] = sourceMessage.sender != sourceMessage.receiver
+                    newRows.append(newRow)
+                elif any(getattr(targetMessage, flag) != value for flag, value in sideFlags.items()):
+                    for flag, value in sideFlags.items():
+                        setattr(targetMessage, flag, value)
+                    if targetMessage.isDeltedBySender and targetMessage.isDeltedByReceiver:
+                        targetSession.delete(targetMessage)
+                    elif messagesModel is self.messageModel and not targetMessage.isDeltedBySender and \
+                            not targetMessage.isDeltedByReceiver:
+                        targetMessage.isCopy = False
+                else:
+                    continue
+                changedMessages += 1
+            targetSession.bulk_insert_mappings(messagesModel, newRows)
+            targetSession.commit()
+            sourceSession.commit()
+        return changedMessages
+
+    def removeMailboxSide(self, messagesModel, userId, shardSession):
+        """
+        a function that turns off the side of a user in a table of messages of a shard he was moved away from, the
+        messages that nobody sees there anymore are removed, the others are kept for their other side
+        :param messagesModel: the messages or the archived messages
+        :param userId: the user that was moved
+        :param shardSession: the session of the shard he was moved from
+        :return: void
+        """
+        # the other side of the messages that are kept is on this shard, and his side is now on his new shard
+        copyFlag = {'isCopy': True} if messagesModel is self.messageModel else {}
+        shardSession.query(messagesModel) \
+            .filter(messagesModel.receiver == userId, messagesModel.isDeltedByReceiver == False) \
+            .update(dict(copyFlag, isDeltedByReceiver=True), synchronize_session=False)
+        shardSession.query(messagesModel) \
+            .filter(messagesModel.sender == userId, messagesModel.isDeltedBySender == False) \
+            .update(dict(copyFlag, isDeltedBySender=True), synchronize_session=False)
+        shardSession.query(messagesModel) \
+            .filter(or_(messagesModel.receiver == userId, messagesModel.sender == userId),
+                    messagesModel.isDeltedBySender == True, messagesModel.isDeltedByReceiver == True) \
+            .delete(synchronize_session=False)
+        shardSession.commit()
+
+    def moveUserToShard(self, userId, targetShard):
+        """
+        a function that moves the mailbox of a user to another shard while he (and everyone else) keeps using the
+        service. the mailbox is copied while it's still used on the old shard, again and again until a whole copy
+        saw no change (by the mailbox version), then the counters on the old shard are fenced (movedToShard) so
+        every further change there fails with UserMovedError and waits for the move, the last changes are copied,
+        the counters are counted on the new shard and the shard directory is switched. the old shard still holds
+        the mailbox for the workers that didn't see the switch yet, see removeMovedMailbox
+        :param userId: the user to move
+        :param targetShard: the shard to move him to
+        :return: the shard he was moved from, None if he is already on the target shard
+        """
+        shardRouter = self.shardRouter
+        counterModel = self.counterModel
+        sourceShard = shardRouter.lookUpShardNow(userId)
+        if sourceShard == targetShard:
+            return None
+        sourceSession = shardRouter.sessions[sourceShard]
+        targetSession = shardRouter.sessions[targetShard]
+
+        def copyWholeMailbox():
+            self.copyMailboxSide(self.messageModel, userId, sourceSession, targetSession)
+            self.copyMailboxSide(self.archivedMessageModel, userId, shardRouter.archiveSessions[sourceShard],
+                                 shardRouter.archiveSessions[targetShard])
+
+        def sourceVersion():
+            mailboxVersion = sourceSession.query(counterModel.mailboxVersion) \
+                .filter(counterModel.userId == userId).scalar()
+            sourceSession.commit()
+            return mailboxVersion
+
+        for _ in range(MOVE_USER_COPY_PASSES):
+            versionBeforeCopy = sourceVersion()
+            copyWholeMailbox()
+            if sourceVersion() == versionBeforeCopy:
+                break
+        # the fence, the version is bumped too so no response built before it is cached for the new version
+        if not sourceSession.query(counterModel).filter(counterModel.userId == userId).update(
+                {counterModel.movedToShard: targetShard,
+                 counterModel.mailboxVersion: counterModel.mailboxVersion + 1}, synchronize_session=False):
+            sourceSession.add(counterModel(userId=userId, movedToShard=targetShard))
+        sourceSession.commit()
+        copyWholeMailbox()
+
+        # the counters left on the target by an earlier move away from it, their version must not be given again
+        earlierVersion = targetSession.query(counterModel.mailboxVersion).filter(counterModel.userId == userId) \
+            .scalar() or 0
+        targetSession.query(counterModel).filter(counterModel.userId == userId).delete(synchronize_session=False)
+        counters = self.countMailbox(targetSession, userId)
+        counters.mailboxVersion = max(sourceVersion() or 0, earlierVersion) + 1
+        targetSession.add(counters)
+        targetSession.commit()
+
+        directoryModel = shardRouter.directoryModel
+        directorySession = shardRouter.sessions[0]
+        directoryVersion = (directorySession.query(func.max(directoryModel.version)).scalar() or 0) + 1
+        directorySession.merge(directoryModel(userId=userId, shardNumber=targetShard, version=directoryVersion))
+        directorySession.commit()
+        shardRouter.shardsByUser.put(userId, targetShard)
+        return sourceShard
+
+    def removeMovedMailbox(self, userId, sourceShard):
+        """
+        a function that removes the mailbox of a moved user from the shard he was moved from, it must run only
+        after every worker had the time to notice the move (SHARD_DIRECTORY_CHECK_INTERVAL), his fenced counters
+        are kept there so a worker that still routes him to the old shard finds out where he went
+        :param userId: the user that was moved
+        :param sourceShard: the shard he was moved from
+        :return: void
+        """
+        self.removeMailboxSide(self.messageModel, userId, self.shardRouter.sessions[sourceShard])
+        self.removeMailboxSide(self.archivedMessageModel, userId, self.shardRouter.archiveSessions[sourceShard])
+
+
+# ---------------------------------------FUNCTIONS------------------------------------------------------------
+
+def mailboxSideCondition(messagesModel, userId):
+    """
+    a function that builds the condition of the messages a user still sees in a table of messages
+    :param messagesModel: the messages or the archived messages
+    :param userId: the given userId
+    :return: the condition
+    """
+    return or_(and_(messagesModel.receiver == userId, messagesModel.isDeltedByReceiver == False),
+               and_(messagesModel.sender == userId, messagesModel.isDeltedBySender == False))
@@ -0,0 +1,35 @@
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+# main reads its configuration when it's imported, so the tests get a database of their own (and a single shard)
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'testMessagesDB.db')
+os.environ.pop('SHARD_DATABASE_URLS', None)
+os.environ.pop('ARCHIVE_DATABASE_URL', None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    return main.app.test_client()
+
+
+@pytest.fixture
+def registerUser(client):
+    """
+    a fixture that registers users under new usernames (every test shares the database)
+    :return: a function that takes a name and returns the username and the authorization headers of the new user
+    """
+    def register(name):
+        username = name + '-' + uuid.uuid4().hex[:8]
+        assert client.post('/registerUser', json={'newUsername': username, 'newPassword': 'password'}) \
+            .status_code == 200
+        accessToken = client.post('/login', json={'username': username, 'password': 'password'}) \
+            .json['access_token']
+        return username, {'Authorization': 'Bearer ' + accessToken}
+    return register
@@ -0,0 +1,34 @@
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize('path', ['/getAllMessages', '/getAllUnreadMessages', '/getArchivedMessages'])
+@pytest.mark.parametrize('afterId', ['-1', 'abc', '99999999999999999999999'])
+def test_invalid_pagination_cursor_is_rejected(client, registerUser, path, afterId):
+    _, headers = registerUser('user')
+    response = client.get(path + '?after_id=' + afterId, headers=headers)
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('body', [
+    {'receivers': 'bob', 'subject': 'subject', 'body': 'body'},
+    {'receivers': [['bob']], 'subject': 'subject', 'body': 'body'},
+    {'messages': ['bob']},
+    {'messages': [{'receiver': ['bob'], 'subject': 'subject', 'body': 'body'}]},
+    {'messages': {'receiver': 'bob'}},
+    ['bob'],
+])
+def test_malformed_messages_are_rejected(client, registerUser, body):
+    _, headers = registerUser('sender')
+    response = client.post('/writeMessages', json=body, headers=headers)
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('pagination', ['offset=-1', 'offset=99999999999999999999999', 'limit=0', 'limit=abc'])
+def test_invalid_search_pagination_is_rejected(client, registerUser, pagination):
+    if not main.searchIndexAvailable:
+        pytest.skip('the SQLite library has no FTS5')
+    _, headers = registerUser('user')
+    response = client.get('/searchMessages?q=hello&' + pagination, headers=headers)
+    assert response.status_code == 400
@@ -0,0 +1,41 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+import main
+
+
+def pragma(name):
+    with main.engine.connect() as connection:
+        return connection.execute(text('PRAGMA ' + name)).scalar()
+
+
+def test_new_database_vacuums_incrementally():
+    # 2 is INCREMENTAL
+    assert pragma('auto_vacuum') == 2
+
+
+def test_compaction_gives_the_free_pages_back(registerUser, monkeypatch):
+    monkeypatch.setattr(main, 'ARCHIVE_DELETED_AFTER_DAYS', 30)
+    monkeypatch.setattr(main, 'ARCHIVE_AFTER_DAYS', -1)
+    monkeypatch.setattr(main, 'COMPACTION_PAUSE', 0)
+    sender = main.convertUsernameToId(registerUser('sender')[0])
+    receiver = main.convertUsernameToId(registerUser('receiver')[0])
+    oldDate = datetime.now() - timedelta(days=31)
+    # messages that both sides deleted are removed right away and leave free pages behind, and an old one that
+    # only its receiver deleted is left for the compaction
+    with main.engine.begin() as connection:
+        connection.execute(main.Message.__table__.insert(), [
+            {'sender': sender, 'receiver': receiver, 'subjectOfTheMessage': 'subject',
+             'bodyOfTheMessage': 'x' * main.MAX_MESSAGE_LENGTH, 'creationDate': oldDate, 'isRead': True,
+             'isDeltedBySender': False, 'isDeltedByReceiver': True} for _ in range(400)])
+        connection.execute(main.Message.__table__.delete().where(main.Message.receiver == receiver,
+                                                                 main.Message.subjectOfTheMessage == 'subject'))
+        connection.execute(main.Message.__table__.insert(), {
+            'sender': sender, 'receiver': receiver, 'subjectOfTheMessage': 'old', 'bodyOfTheMessage': 'body',
+            'creationDate': oldDate, 'isRead': True, 'isDeltedBySender': False, 'isDeltedByReceiver': True})
+    freePagesBefore = pragma('freelist_count')
+    assert freePagesBefore > 0
+
+    assert main.compactMessages() >= 1
+    assert pragma('freelist_count') < freePagesBefore
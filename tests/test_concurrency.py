@@ -0,0 +1,60 @@
+import random
+import threading
+from collections import Counter
+
+import main
+
+NUMBER_OF_USERS = 6
+NUMBER_OF_CLIENTS = 8
+REQUESTS_PER_CLIENT = 40
+
+
+def test_parallel_writes_and_reads_lose_nothing(registerUser):
+    users = [registerUser('user') for _ in range(NUMBER_OF_USERS)]
+    errors = []
+    sentTo = Counter()
+    shownMessageIds = {username: [] for username, _ in users}
+    lock = threading.Lock()
+
+    def sendAndRead(clientNumber):
+        client = main.app.test_client()
+        randomGenerator = random.Random(clientNumber)
+        for requestNumber in range(REQUESTS_PER_CLIENT):
+            username, headers = users[randomGenerator.randrange(NUMBER_OF_USERS)]
+            if requestNumber % 2 == 0:
+                receiver = users[randomGenerator.randrange(NUMBER_OF_USERS)][0]
+                response = client.post('/writeMessage', headers=headers,
+                                       json={'receiver': receiver, 'subject': 'subject', 'body': 'body'})
+                if response.status_code == 200:
+                    with lock:
+                        sentTo[receiver] += 1
+            else:
+                response = client.get('/readMessage', headers=headers)
+                if response.status_code == 200 and 'id' in response.json:
+                    with lock:
+                        shownMessageIds[username].append(response.json['id'])
+            if response.status_code != 200:
+                with lock:
+                    errors.append((response.status_code, response.get_data(as_text=True)))
+
+    clients = [threading.Thread(target=sendAndRead, args=(clientNumber,)) for clientNumber in range(NUMBER_OF_CLIENTS)]
+    for clientThread in clients:
+        clientThread.start()
+    for clientThread in clients:
+        clientThread.join()
+
+    assert errors == []
+    # the counters saw every change (nothing was overwritten by a concurrent request)
+    countedMailboxes = main.countAllMailboxes()
+    for username, _ in users:
+        userId = main.convertUsernameToId(username)
+        counters = main.getMailboxCounters(userId)
+        assert (counters.unreadMessages, counters.readMessages, counters.sentMessages) == countedMailboxes[userId]
+    main.session.remove()
+    # every message that was sent arrived once, and every message shown by /readMessage is one of them
+    client = main.app.test_client()
+    for username, headers in users:
+        mailbox = client.get('/getAllMessages', headers=headers).json
+        receivedIds = [message['id'] for message in mailbox['read messages'] + mailbox['unread messages']]
+        assert len(receivedIds) == len(set(receivedIds)) == sentTo[username]
+        assert set(shownMessageIds[username]) <= set(receivedIds)
@@ -0,0 +1,61 @@
+import threading
+import time
+
+from sqlalchemy import create_engine, func, text
+
+import main
+
+
+def test_change_ids_are_not_given_again_after_pruning():
+    main.session.bulk_insert_mappings(main.MailboxChange, [{'userId': 1, 'workerId': 'worker'}] * 3)
+    main.session.commit()
+    lastSeenChangeId = main.session.query(func.max(main.MailboxChange.id)).scalar()
+    # the poller prunes every change once nothing was sent for a while
+    main.session.query(main.MailboxChange).delete()
+    main.session.commit()
+    main.session.add(main.MailboxChange(userId=1, workerId='worker'))
+    main.session.commit()
+    assert main.session.query(func.max(main.MailboxChange.id)).scalar() > lastSeenChangeId
+    main.session.remove()
+
+
+def test_change_log_without_autoincrement_is_recreated(tmp_path):
+    databaseEngine = create_engine('sqlite:///' + str(tmp_path / 'old.db'))
+    with databaseEngine.begin() as connection:
+        connection.execute(text('CREATE TABLE "MailboxChanges" (id INTEGER NOT NULL, "userId" INTEGER NOT NULL, '
+                                '"workerId" VARCHAR(32) NOT NULL, "createdAt" DATETIME NOT NULL, PRIMARY KEY (id))'))
+    main.migrateChangeLog(databaseEngine)
+    with databaseEngine.connect() as connection:
+        assert 'AUTOINCREMENT' in connection.execute(text(
+            "SELECT sql FROM sqlite_master WHERE name = 'MailboxChanges'")).scalar()
+
+
+def test_wait_that_missed_its_notification_answers_the_current_count(client, registerUser, monkeypatch):
+    _, senderHeaders = registerUser('sender')
+    receiver, receiverHeaders = registerUser('receiver')
+    # the message arrives while the request waits, but its notification is lost
+    monkeypatch.setattr(main.mailboxNotifier, 'publish', lambda userIds: None)
+
+    def sendLater():
+        time.sleep(0.2)
+        main.app.test_client().post('/writeMessage', headers=senderHeaders,
+                                    json={'receiver': receiver, 'subject': 'subject', 'body': 'body'})
+
+    senderThread = threading.Thread(target=sendLater)
+    senderThread.start()
+    response = client.get('/waitForMessages?timeout=1', headers=receiverHeaders)
+    senderThread.join()
+    assert response.json == {'unread count': 1}
+
+
+def test_changes_sent_through_another_worker_wake_up_the_waiting_requests(client, registerUser, monkeypatch):
+    _, senderHeaders = registerUser('sender')
+    receiver, _ = registerUser('receiver')
+    receiverId = main.convertUsernameToId(receiver)
+    monkeypatch.setattr(main, 'mailboxNotifier', main.ChangeLogMailboxNotifier())
+    otherWorkerNotifier = main.ChangeLogMailboxNotifier()
+    otherWorkerNotifier.lastSeenChangeIds = otherWorkerNotifier.readLatestChangeIds()
+    client.post('/writeMessage', headers=senderHeaders, json={'receiver': receiver, 'subject': 's', 'body': 'b'})
+    otherWorkerNotifier.notifyChangesOfOtherWorkers()
+    main.shardRouter.removeSessions()
+    assert otherWorkerNotifier.versions.get(receiverId) == 1
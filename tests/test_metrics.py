@@ -0,0 +1,13 @@
+def test_every_metric_family_is_one_contiguous_group(client):
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    familiesSeen = []
+    for line in response.get_data(as_text=True).splitlines():
+        if line.startswith('# TYPE '):
+            familyName = line.split()[2]
+            assert familyName not in familiesSeen
+            familiesSeen.append(familyName)
+        elif line:
+            sampleName = line.split('{')[0].split(' ')[0]
+            # the samples of a histogram end with _bucket, _sum or _count
+            assert familiesSeen and sampleName.startswith(familiesSeen[-1]), line
@@ -0,0 +1,84 @@
+import uuid
+from datetime import datetime
+
+from sqlalchemy import event
+
+import main
+
+SMALL_MAILBOX = 5
+
+
+def sendMessages(client, headers, receiver, numberOfMessages):
+    response = client.post('/writeMessages', headers=headers, json={
+        'messages': [{'receiver': receiver, 'subject': 'subject', 'body': 'body ' + str(number)}
+                     for number in range(numberOfMessages)]})
+    assert response.status_code == 200
+
+
+def countQueries(client, path, headers):
+    statements = []
+
+    def countStatement(connection, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    # the archive may be a database of its own
+    databaseEngines = {main.engine, main.archiveEngine}
+    for databaseEngine in databaseEngines:
+        event.listen(databaseEngine, 'before_cursor_execute', countStatement)
+    try:
+        response = client.get(path, headers=headers)
+    finally:
+        for databaseEngine in databaseEngines:
+            event.remove(databaseEngine, 'before_cursor_execute', countStatement)
+    assert response.status_code == 200
+    return len(statements)
+
+
+def mailboxesOfTwoSizes(client, registerUser):
+    # the receivers of a small and of a ten times bigger mailbox, each with read, unread and sent messages
+    _, senderHeaders = registerUser('sender')
+    mailboxes = []
+    for numberOfMessages in (SMALL_MAILBOX, 10 * SMALL_MAILBOX):
+        receiver, receiverHeaders = registerUser('receiver')
+        sendMessages(client, senderHeaders, receiver, numberOfMessages)
+        assert client.get('/getAllUnreadMessages', headers=receiverHeaders).status_code == 200
+        sendMessages(client, senderHeaders, receiver, numberOfMessages)
+        sendMessages(client, receiverHeaders, receiver, numberOfMessages)
+        mailboxes.append(receiverHeaders)
+    return mailboxes
+
+
+def test_get_all_messages_queries_do_not_grow_with_the_mailbox(client, registerUser):
+    smallMailbox, bigMailbox = mailboxesOfTwoSizes(client, registerUser)
+    assert countQueries(client, '/getAllMessages', smallMailbox) == \
+        countQueries(client, '/getAllMessages', bigMailbox)
+
+
+def test_read_message_queries_do_not_grow_with_the_mailbox(client, registerUser):
+    smallMailbox, bigMailbox = mailboxesOfTwoSizes(client, registerUser)
+    assert countQueries(client, '/readMessage', smallMailbox) == countQueries(client, '/readMessage', bigMailbox)
+
+
+def archiveFromManySenders(registerUser, numberOfMessages):
+    # every archived message comes from a sender of its own, none of them in the username cache
+    receiver, receiverHeaders = registerUser('receiver')
+    receiverId = main.convertUsernameToId(receiver)
+    senders = [main.User(username='sender-' + uuid.uuid4().hex[:8], password='password')
+               for _ in range(numberOfMessages)]
+    main.session.add_all(senders)
+    main.session.commit()
+    main.archiveSession.bulk_insert_mappings(main.ArchivedMessage, [
+        {'id': 10 ** 9 + sender.userId, 'sender': sender.userId, 'receiver': receiverId, 'subjectOfTheMessage': 's',
+         'bodyOfTheMessage': 'b', 'creationDate': datetime.now(), 'isRead': False, 'isDeltedBySender': False,
+         'isDeltedByReceiver': False} for sender in senders])
+    main.archiveSession.commit()
+    main.session.remove()
+    main.archiveSession.remove()
+    return receiverHeaders
+
+
+def test_archived_messages_queries_do_not_grow_with_the_archive(client, registerUser):
+    smallArchive = archiveFromManySenders(registerUser, SMALL_MAILBOX)
+    bigArchive = archiveFromManySenders(registerUser, 10 * SMALL_MAILBOX)
+    assert countQueries(client, '/getArchivedMessages', smallArchive) == \
+        countQueries(client, '/getArchivedMessages', bigArchive)
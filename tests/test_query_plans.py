@@ -0,0 +1,90 @@
+from collections import namedtuple
+
+import pytest
+from sqlalchemy import event
+
+import main
+
+Mailbox = namedtuple('Mailbox', 'sender senderHeaders receiver receiverHeaders messageId')
+
+# the requests that exercise every query of an endpoint (every part of the mailbox, with and without the keyset
+# pagination cursor, both branches of /readMessage, a message that is in the Messages table and one that isn't)
+ENDPOINT_REQUESTS = {
+    '/login': lambda client, mailbox: [
+        client.post('/login', json={'username': mailbox.receiver, 'password': 'password'})],
+    '/registerUser': lambda client, mailbox: [
+        client.post('/registerUser', json={'newUsername': mailbox.receiver + '-new', 'newPassword': 'password'})],
+    '/writeMessage': lambda client, mailbox: [
+        client.post('/writeMessage', headers=mailbox.senderHeaders,
+                    json={'receiver': mailbox.receiver, 'subject': 'subject', 'body': 'body'})],
+    '/writeMessages': lambda client, mailbox: [
+        client.post('/writeMessages', headers=mailbox.senderHeaders,
+                    json={'receivers': [mailbox.receiver, mailbox.sender], 'subject': 'subject', 'body': 'body'})],
+    '/getAllMessages': lambda client, mailbox: [
+        client.get('/getAllMessages', headers=mailbox.receiverHeaders),
+        client.get('/getAllMessages?after_id=0&limit=10', headers=mailbox.receiverHeaders),
+        client.get('/getAllMessages?stream=true', headers=mailbox.receiverHeaders)],
+    '/getAllUnreadMessages': lambda client, mailbox: [
+        client.get('/getAllUnreadMessages?after_id=0&limit=10', headers=mailbox.receiverHeaders),
+        client.get('/getAllUnreadMessages', headers=mailbox.receiverHeaders)],
+    '/readMessage': lambda client, mailbox: [
+        client.get('/readMessage', headers=mailbox.receiverHeaders) for _ in range(3)],
+    '/unreadCount': lambda client, mailbox: [
+        client.get('/unreadCount', headers=mailbox.receiverHeaders)],
+    '/searchMessages': lambda client, mailbox: [
+        client.get('/searchMessages?q=hello', headers=mailbox.receiverHeaders),
+        client.get('/searchMessages?q=hel*&role=sent', headers=mailbox.senderHeaders)],
+    '/getArchivedMessages': lambda client, mailbox: [
+        client.get('/getArchivedMessages', headers=mailbox.receiverHeaders),
+        client.get('/getArchivedMessages?after_id=0&limit=10', headers=mailbox.receiverHeaders)],
+    '/deleteMessage/<id>': lambda client, mailbox: [
+        client.delete('/deleteMessage/' + str(mailbox.messageId), headers=mailbox.receiverHeaders),
+        client.delete('/deleteMessage/' + str(mailbox.messageId), headers=mailbox.senderHeaders),
+        client.delete('/deleteMessage/' + str(mailbox.messageId + 1000000), headers=mailbox.receiverHeaders)],
+}
+
+
+@pytest.fixture
+def mailbox(client, registerUser):
+    sender, senderHeaders = registerUser('sender')
+    receiver, receiverHeaders = registerUser('receiver')
+    for subject in ('hello', 'hello again'):
+        assert client.post('/writeMessage', headers=senderHeaders,
+                           json={'receiver': receiver, 'subject': subject, 'body': 'hello world'}).status_code == 200
+    messageId = client.get('/getAllMessages', headers=senderHeaders).json['sent messages'][0]['id']
+    return Mailbox(sender, senderHeaders, receiver, receiverHeaders, messageId)
+
+
+def explainQueryPlan(statement, parameters):
+    with main.engine.connect() as connection:
+        return [row[-1] for row in connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters)]
+
+
+@pytest.mark.parametrize('endpoint', sorted(ENDPOINT_REQUESTS))
+def test_every_query_of_the_endpoint_searches_an_index(client, mailbox, endpoint):
+    if endpoint == '/searchMessages' and not main.searchIndexAvailable:
+        pytest.skip('the SQLite library has no FTS5')
+    executedStatements = []
+
+    def recordStatement(connection, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+            executedStatements.append((statement, parameters))
+
+    main.responseCache.clear()
+    event.listen(main.engine, 'before_cursor_execute', recordStatement)
+    try:
+        for response in ENDPOINT_REQUESTS[endpoint](client, mailbox):
+            response.get_data()
+    finally:
+        event.remove(main.engine, 'before_cursor_execute', recordStatement)
+    assert executedStatements
+
+    for statement, parameters in executedStatements:
+        queryPlan = explainQueryPlan(statement, parameters)
+        # the full text index is a virtual table, a MATCH on it is a search even though it's reported as a scan
+        scans = [step for step in queryPlan if step.startswith('SCAN ') and 'CONSTANT ROW' not in step and
+                 'VIRTUAL TABLE' not in step]
+        assert not scans, statement + ': ' + '; '.join(queryPlan)
+        if 'MATCH' not in statement:
+            # the mailbox indexes end with the message id, so they give the order of the pages too
+            assert 'USE TEMP B-TREE FOR ORDER BY' not in queryPlan, statement + ': ' + '; '.join(queryPlan)
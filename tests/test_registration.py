@@ -0,0 +1,26 @@
+import uuid
+
+import main
+
+
+def test_username_registered_by_another_worker_is_rejected(client):
+    username = 'user-' + uuid.uuid4().hex[:8]
+    # this worker looks the username up and remembers it as not registered
+    assert not main.checkIfUserExistsByUsername(username)
+    # then another worker registers it
+    with main.engine.begin() as connection:
+        connection.execute(main.User.__table__.insert(), {'username': username, 'password': 'password'})
+
+    response = client.post('/registerUser', json={'newUsername': username, 'newPassword': 'password'})
+    assert response.status_code == 400
+    assert response.json['message'] == main.ERROR_USERNAME_ALREADY_USED
+    assert main.checkIfUserExistsByUsername(username)
+    main.session.remove()
+
+
+def test_missing_or_invalid_username_is_rejected(client):
+    for body in ({}, {'newUsername': None, 'newPassword': 'password'}, {'newUsername': 5, 'newPassword': 'password'},
+                 {'newUsername': '', 'newPassword': 'password'}, ['newUsername']):
+        response = client.post('/registerUser', json=body)
+        assert response.status_code == 400
+        assert response.json['message'] == main.ERROR_INVALID_USERNAME
@@ -0,0 +1,29 @@
+import main
+
+
+def test_cache_is_bounded_by_the_total_size_of_its_values():
+    cache = main.LRUCache(10, sizeOf=len)
+    cache.put('first', 'aaaa')
+    cache.put('second', 'bbbb')
+    cache.put('third', 'cccc')
+    assert cache.get('first') is None
+    assert cache.totalSize == 8
+    cache.put('second', 'bb')
+    assert cache.totalSize == 6
+    # a value bigger than the whole cache is not kept, and neither is the old value of its key
+    cache.put('third', 'c' * 11)
+    assert cache.get('third') is None
+    assert cache.totalSize == 2
+
+
+def test_new_mailbox_version_replaces_the_cached_response(client, registerUser):
+    _, senderHeaders = registerUser('sender')
+    receiver, receiverHeaders = registerUser('receiver')
+    receiverId = main.convertUsernameToId(receiver)
+    for expectedCount in (1, 2):
+        client.post('/writeMessage', headers=senderHeaders, json={'receiver': receiver, 'subject': 's', 'body': 'b'})
+        assert client.get('/unreadCount', headers=receiverHeaders).status_code == 200
+        assert client.get('/unreadCount?x=1', headers=receiverHeaders).status_code == 200
+        assert client.get('/unreadCount', headers=receiverHeaders).json == {'unread count': expectedCount}
+    cachedKeys = [cacheKey for cacheKey in main.responseCache.entries if cacheKey[0] == receiverId]
+    assert sorted(cachedKeys) == [(receiverId, '/unreadCount', b''), (receiverId, '/unreadCount', b'x=1')]
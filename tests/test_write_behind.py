@@ -0,0 +1,39 @@
+import sqlite3
+import threading
+import time
+
+import main
+
+
+def test_message_that_timed_out_in_the_queue_is_not_stored(client, registerUser, monkeypatch):
+    _, senderHeaders = registerUser('sender')
+    receiver, receiverHeaders = registerUser('receiver')
+    monkeypatch.setattr(main, 'WRITE_BEHIND_TIMEOUT', 0.5)
+    monkeypatch.setattr(main, 'groupCommitWriters', [main.GroupCommitWriter(0, main.WRITE_BEHIND_BATCH_SIZE,
+                                                                            main.WRITE_BEHIND_MAX_DELAY, 10)])
+    # another connection holds the write lock, so the writer is stuck on the first message
+    lockingConnection = sqlite3.connect(main.engine.url.database, isolation_level=None)
+    lockingConnection.execute('BEGIN IMMEDIATE')
+    responses = {}
+
+    def send(subject):
+        responses[subject] = main.app.test_client().post(
+            '/writeMessage', headers=senderHeaders, json={'receiver': receiver, 'subject': subject, 'body': 'body'})
+
+    firstSender = threading.Thread(target=send, args=('taken by the writer',))
+    firstSender.start()
+    time.sleep(0.1)
+    secondSender = threading.Thread(target=send, args=('still queued',))
+    secondSender.start()
+    time.sleep(1)
+    lockingConnection.execute('COMMIT')
+    lockingConnection.close()
+    firstSender.join()
+    secondSender.join()
+    time.sleep(0.2)
+
+    # the message a writer was storing is waited for, the one still in the queue is taken back
+    assert responses['taken by the writer'].status_code == 200
+    assert responses['still queued'].status_code == 503
+    mailbox = client.get('/getAllMessages', headers=receiverHeaders).json
+    assert [message['subject'] for message in mailbox['unread messages']] == ['taken by the writer']